@@ -2,11 +2,55 @@ import os
 import numpy as np
 import torch
 import json
+import threading
+import hashlib
+import logging
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
 from werkzeug.utils import secure_filename
-from scipy.spatial.distance import cosine
 import io
-import traceback
+
+# Default to WARNING in production so per-request (and per-user) log lines
+# cost nothing when debugging is off; override with LOG_LEVEL=DEBUG/INFO.
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+# Optional orjson for the user-data and prompts JSON paths: 2-5x faster than
+# stdlib json on the Unicode-heavy Hindi/Tamil content.
+try:
+    import orjson
+    logger.info("orjson found. Using it for user-data/prompts JSON.")
+except ImportError:
+    orjson = None
+    logger.info("orjson not installed. Using stdlib json.")
+
+# Optional SIMD-accelerated cosine backend (AVX-512/NEON kernels).
+# Falls back to the NumPy/BLAS matmul path when the wheel is unavailable.
+try:
+    import simsimd
+    logger.info("simsimd found. Using SIMD cosine kernels for speaker matching.")
+except ImportError:
+    simsimd = None
+    logger.info("simsimd not installed. Using NumPy for speaker matching.")
+
+# Optional BLAKE3 for hashing uploaded audio (content-addressed embedding
+# cache). Falls back to stdlib blake2b when the wheel is unavailable.
+try:
+    import blake3
+    logger.info("blake3 found. Using BLAKE3 for the audio cache keys.")
+except ImportError:
+    blake3 = None
+    logger.info("blake3 not installed. Using blake2b for the audio cache keys.")
+
+# Optional FAISS index for the nearest-speaker search. Exact IndexFlatIP
+# over normalized embeddings (cosine = inner product); scales the match to
+# large user counts and leaves an ANN upgrade path.
+try:
+    import faiss
+    logger.info("faiss found. Using IndexFlatIP for speaker matching.")
+except ImportError:
+    faiss = None
+    logger.info("faiss not installed. Using batched distance computation for speaker matching.")
 
 # Import your custom modules
 from preprocess import preprocess_audio_from_bytes, SAMPLE_RATE
@@ -18,15 +62,24 @@ app.config['SECRET_KEY'] = os.urandom(24)
 app.config['EMBEDDING_DIR'] = "saved_embeddings"
 app.config['PRETRAINED_MODEL_DIR'] = "pretrained_models"
 app.config['USER_DATA_FILE'] = "user_data.json"
+app.config['EMBEDDING_CACHE_DIR'] = "embedding_cache"
+app.config['EMBEDDING_CACHE_MAX_FILES'] = 256 # LRU eviction kicks in above this
 
 # !!! ADJUST THIS THRESHOLD BASED ON TESTING - critical for this approach !!!
 # The threshold determines the maximum allowed distance for a "match".
 # Start with a value like 0.4 and test EXTENSIVELY with different speakers.
 app.config['COSINE_THRESHOLD'] = 0.4 # <<<< TUNE THIS VALUE CAREFULLY
-print(f"!!! Speaker Verification Threshold: {app.config['COSINE_THRESHOLD']}. Tuning Required! !!!")
+logger.warning("Speaker Verification Threshold: %s. Tuning Required!", app.config['COSINE_THRESHOLD'])
 
 app.config['DEVICE'] = "cuda" if torch.cuda.is_available() else "cpu"
 
+# The hot paths (encoder forward, batched distance matmul) all release the
+# GIL, so concurrent logins scale with server threads. Pin torch's intra-op
+# pool to 1 thread per worker so multiple gunicorn workers don't
+# oversubscribe the cores; override via TORCH_NUM_THREADS if running a
+# single worker.
+torch.set_num_threads(int(os.environ.get('TORCH_NUM_THREADS', '1')))
+
 # --- Language Configuration (Keep as before) ---
 SUPPORTED_LANGUAGES = {"en": "English", "hi": "Hindi (हिन्दी)", "ta": "Tamil (தமிழ்)"}
 LANGUAGE_PROMPTS = { # Tuples: (Enroll1, Enroll2, Login)
@@ -34,10 +87,15 @@ LANGUAGE_PROMPTS = { # Tuples: (Enroll1, Enroll2, Login)
     "hi": ("आज मौसम बहुत सुहावना है, टहलने के लिए बढ़िया।", "किताबें पढ़ना नई दुनिया के दरवाजे खोलता है।", "संगीत अक्सर खुशी लाता है और आत्मा को उत्साहित करता है।"),
     "ta": ("இன்று வானிலை மிகவும் அழகாக இருக்கிறது, நடைப்பயிற்சிக்கு ஏற்றது.", "புத்தகங்கள் வாசிப்பது புதிய உலகங்களுக்கான கதவுகளைத் திறக்கிறது.", "இசை பெரும்பாலும் மகிழ்ச்சியைத் தருகிறது மற்றும் உற்சாகமூட்டுகிறது.")
 }
+# The prompts never change at runtime - serialize once at import instead of
+# re-serializing on every enroll/login page render
+LANGUAGE_PROMPTS_JSON = (orjson.dumps(LANGUAGE_PROMPTS).decode('utf-8') if orjson is not None
+                         else json.dumps(LANGUAGE_PROMPTS, ensure_ascii=False))
 
 # Create necessary directories
 os.makedirs(app.config['EMBEDDING_DIR'], exist_ok=True)
 os.makedirs(app.config['PRETRAINED_MODEL_DIR'], exist_ok=True)
+os.makedirs(app.config['EMBEDDING_CACHE_DIR'], exist_ok=True)
 
 # --- Initialize Model (Keep as before - ensure using spkrec model) ---
 try:
@@ -47,42 +105,228 @@ try:
         savedir=app.config['PRETRAINED_MODEL_DIR']
     )
     EMBEDDING_DIM = model.embedding_size # Should be 192
-    print(f"App confirmed embedding dimension: {EMBEDDING_DIM}")
+    logger.info("App confirmed embedding dimension: %s", EMBEDDING_DIM)
     if EMBEDDING_DIM != 192:
-        print(f"ERROR: App expected EMBEDDING_DIM 192, got {EMBEDDING_DIM}!")
+        logger.error("App expected EMBEDDING_DIM 192, got %s!", EMBEDDING_DIM)
         exit()
 except Exception as model_init_error:
-    print(f"FATAL: Could not initialize model: {model_init_error}")
+    logger.critical("Could not initialize model: %s", model_init_error)
     exit()
 
-# --- User Metadata Handling (Keep load/save as before) ---
+# --- User Metadata Handling ---
+# In-memory mirror of user_data.json keyed on mtime: process_login otherwise
+# parses the JSON twice per request (once via the enrolled-embedding cache,
+# once for the language lookup).
+_user_cache = {'mtime': None, 'data': {}}
+
 def load_user_data():
     filepath = app.config['USER_DATA_FILE']
-    if not os.path.exists(filepath): return {}
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f: data = json.load(f)
-        if not isinstance(data, dict): return {}
-        return data
-    except Exception as e: print(f"Error loading user data: {e}"); return {}
+    try: mtime = os.stat(filepath).st_mtime_ns
+    except OSError: return {}
+    if mtime != _user_cache['mtime']:
+        try:
+            with open(filepath, 'rb') as f: raw = f.read()
+            data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            if not isinstance(data, dict): data = {}
+            _user_cache['data'] = data; _user_cache['mtime'] = mtime
+        except Exception as e: logger.error("Error loading user data: %s", e); return {}
+    # Shallow copy: enrollment mutates the returned dict before saving, and
+    # handing out the cached dict itself would let one thread resize it while
+    # another is serializing it (and leave phantom users in memory if the
+    # save then fails)
+    return dict(_user_cache['data'])
 
 def save_user_data(data):
     filepath = app.config['USER_DATA_FILE']
     try:
-        with open(filepath, 'w', encoding='utf-8') as f: json.dump(data, f, indent=4, ensure_ascii=False)
-    except Exception as e: print(f"Error saving user data: {e}")
+        if orjson is not None: payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        else: payload = json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8')
+        with open(filepath, 'wb') as f: f.write(payload)
+        _user_cache['data'] = data; _user_cache['mtime'] = os.stat(filepath).st_mtime_ns
+    except Exception as e: logger.error("Error saving user data: %s", e)
 
-# --- Helper Function (get_enrolled_speakers_embeddings - Keep as before) ---
-def get_enrolled_speakers_embeddings():
-    speakers = {}
+# --- Content-Addressed Embedding Cache ---
+# Users often re-submit the same recording (retries, network flakes). Keying
+# on a hash of the raw bytes lets repeats skip both the audio decode and the
+# encoder forward pass entirely.
+def _audio_cache_path(audio_bytes):
+    h = blake3.blake3() if blake3 is not None else hashlib.blake2b(digest_size=32)
+    h.update(model.model_source.encode('utf-8')) # Checkpoint change invalidates the cache
+    h.update(audio_bytes)
+    return os.path.join(app.config['EMBEDDING_CACHE_DIR'], f"{h.hexdigest()}.npy")
+
+def _load_cached_embedding(cache_path):
+    if not os.path.exists(cache_path): return None
+    try:
+        embedding = np.load(cache_path)
+        if embedding.shape != (EMBEDDING_DIM,): return None
+        os.utime(cache_path) # Mark as recently used for eviction
+        return embedding
+    except Exception as e: logger.error("Error reading embedding cache %s: %s", cache_path, e); return None
+
+def _store_cached_embedding(cache_path, embedding):
+    try:
+        np.save(cache_path, embedding)
+        _evict_embedding_cache()
+    except OSError as e: logger.error("Error writing embedding cache %s: %s", cache_path, e)
+
+def _evict_embedding_cache():
+    """Drops the least-recently-used cache entries above the size budget."""
+    cache_dir = app.config['EMBEDDING_CACHE_DIR']
+    try:
+        paths = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+        excess = len(paths) - app.config['EMBEDDING_CACHE_MAX_FILES']
+        if excess <= 0: return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:excess]: os.remove(path)
+    except OSError as e: logger.error("Error evicting embedding cache entries: %s", e)
+
+# --- Enrolled-Embedding Cache ---
+# Reloading every .npy file per login dominates latency once there are more
+# than a handful of users, so keep the stacked matrix in memory and only
+# rebuild when user_data.json changes on disk (e.g. edited out-of-band).
+_ENROLL_LOCK = threading.Lock()
+_ENROLL_USERS = None   # list[str], parallel to rows of _ENROLL_MTX
+_ENROLL_MTX = None     # (N, 192) float32, rows L2-normalized
+_ENROLL_MTIME = None   # mtime of USER_DATA_FILE when the cache was built
+_ENROLL_INDEX = None   # faiss.IndexFlatIP over _ENROLL_MTX rows (when faiss is installed)
+_ENROLL_GPU = None     # torch.Tensor copy of _ENROLL_MTX on the model device (CUDA only)
+
+def _rebuild_enroll_index(E):
+    """(Re)builds the FAISS inner-product index from the enrolled matrix."""
+    if faiss is None or len(E) == 0: return None
+    index = faiss.IndexFlatIP(EMBEDDING_DIM)
+    index.add(E)
+    return index
+
+# Consolidated on-disk matrix: one header-less raw float32 file holding all
+# normalized rows plus a JSON row index. Cold-start then costs a single
+# memmap (served from the OS page cache when warm) instead of N small file
+# opens. Per-user .npz files remain the authoritative store; the mmap is
+# rebuilt from them whenever it is missing or inconsistent.
+def _mmap_paths():
+    return (os.path.join(app.config['EMBEDDING_DIR'], 'embeddings.mmap'),
+            os.path.join(app.config['EMBEDDING_DIR'], 'embeddings_meta.json'))
+
+def _load_enrolled_from_mmap(user_data):
+    """Fast path: loads (usernames, E) from the consolidated mmap file.
+    Returns None when the file is absent or out of sync with user_data."""
+    mmap_path, meta_path = _mmap_paths()
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f: meta = json.load(f)
+        usernames = meta.get('usernames', [])
+        enrolled = {u for u, d in user_data.items() if 'embedding_file' in d}
+        if set(usernames) != enrolled: return None # Stale vs user_data.json
+        if os.path.getsize(mmap_path) != len(usernames) * EMBEDDING_DIM * 4: return None # Truncated/corrupt
+        E = np.memmap(mmap_path, dtype=np.float32, mode='r', shape=(len(usernames), EMBEDDING_DIM))
+        logger.info("Loaded %d speaker embeddings from consolidated mmap.", len(usernames))
+        return usernames, E
+    except (OSError, ValueError, json.JSONDecodeError):
+        return None
+
+def _write_enrolled_mmap(usernames, E):
+    """Rewrites the consolidated mmap file and its row index."""
+    mmap_path, meta_path = _mmap_paths()
+    try:
+        with open(mmap_path, 'wb') as f: f.write(np.ascontiguousarray(E, dtype=np.float32).tobytes())
+        with open(meta_path, 'w', encoding='utf-8') as f: json.dump({'usernames': usernames, 'dim': EMBEDDING_DIM}, f, ensure_ascii=False)
+    except OSError as e: logger.warning("Could not write consolidated embedding file: %s", e)
+
+def _append_enrolled_mmap(username, row):
+    """Appends one normalized row to the consolidated mmap file."""
+    mmap_path, meta_path = _mmap_paths()
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f: meta = json.load(f)
+        with open(mmap_path, 'ab') as f: f.write(np.ascontiguousarray(row, dtype=np.float32).tobytes())
+        meta['usernames'].append(username)
+        with open(meta_path, 'w', encoding='utf-8') as f: json.dump(meta, f, ensure_ascii=False)
+    except (OSError, json.JSONDecodeError) as e: logger.warning("Could not append to consolidated embedding file: %s", e)
+
+def _build_enrolled_matrix():
+    """Rebuilds the (usernames, E) cache: consolidated mmap when in sync,
+    otherwise a per-user file scan (which then refreshes the mmap)."""
     user_data = load_user_data()
+    cached = _load_enrolled_from_mmap(user_data)
+    if cached is not None: return cached
+    usernames = []
+    rows = []
     for username, data in user_data.items():
         if 'embedding_file' in data:
             path = os.path.join(app.config['EMBEDDING_DIR'], data['embedding_file'])
             embedding = model.load_embedding(path) #load_embedding does shape check
-            if embedding is not None: speakers[username] = embedding
-            else: print(f"Could not load embedding file for {username} despite existing metadata.") # Should be handeled within load
-    print(f"Loaded {len(speakers)} valid speaker embeddings (dim={EMBEDDING_DIM}).")
-    return speakers
+            if embedding is not None: usernames.append(username); rows.append(embedding)
+            else: logger.warning("Could not load embedding file for %s despite existing metadata.", username) # Should be handeled within load
+    if not rows:
+        logger.info("Loaded 0 valid speaker embeddings.")
+        return [], np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    E = np.stack(rows).astype(np.float32)
+    E /= np.linalg.norm(E, axis=1, keepdims=True) # Pre-normalize rows so cosine = dot product
+    _write_enrolled_mmap(usernames, E)
+    logger.info("Loaded %d valid speaker embeddings (dim=%d).", len(usernames), EMBEDDING_DIM)
+    return usernames, E
+
+def get_enrolled_speakers_embeddings():
+    """Returns a consistent (usernames, E, index, gpu) snapshot where E is an
+    (N, 192) float32 matrix of L2-normalized enrolled embeddings (rows
+    parallel to usernames), index is the FAISS index over E (or None) and
+    gpu is the device-resident copy of E (or None off CUDA).
+    Served from the in-memory cache unless user_data.json changed.
+    All parts are captured together under the lock so a concurrent
+    enrollment can't leave a login holding an N-entry username list against
+    an (N+1)-row matrix, index or device tensor."""
+    global _ENROLL_USERS, _ENROLL_MTX, _ENROLL_MTIME, _ENROLL_INDEX, _ENROLL_GPU
+    try: mtime = os.path.getmtime(app.config['USER_DATA_FILE'])
+    except OSError: mtime = None
+    with _ENROLL_LOCK:
+        if _ENROLL_MTX is None or mtime != _ENROLL_MTIME:
+            _ENROLL_USERS, _ENROLL_MTX = _build_enrolled_matrix()
+            _ENROLL_MTIME = mtime
+            _ENROLL_INDEX = _rebuild_enroll_index(_ENROLL_MTX)
+            if model.device.type == 'cuda': _ENROLL_GPU = model.set_enrolled(_ENROLL_MTX) # Keep GPU copy in sync
+        return _ENROLL_USERS, _ENROLL_MTX, _ENROLL_INDEX, _ENROLL_GPU
+
+def _cosine_distances(q, E, gpu=None):
+    """All cosine distances between a normalized query vector and the
+    normalized enrolled matrix in one batched call. gpu is the snapshotted
+    device-resident copy of E (used in preference when present)."""
+    if gpu is not None:
+        # Matrix is already resident on the GPU; one on-device matvec
+        return 1.0 - model.score(q, gpu)
+    if simsimd is not None:
+        # SIMD cosine over the whole batch (AVX-512/NEON inside simsimd)
+        return np.asarray(simsimd.cdist(q[None, :], E, metric="cosine"), dtype=np.float32).ravel()
+    return 1.0 - E @ q # Rows and q are unit-norm, so cosine = dot product
+
+def _match_speaker(q, E, index, gpu=None):
+    """Finds the closest enrolled speaker to a normalized query embedding.
+    Returns (row_index, cosine_distance). Uses the snapshotted FAISS index
+    when built, otherwise the batched distance computation."""
+    if index is not None:
+        D, I = index.search(q[None, :], 1)
+        return int(I[0, 0]), float(1.0 - D[0, 0])
+    dists = _cosine_distances(q, E, gpu)
+    idx = int(np.argmin(dists))
+    return idx, float(dists[idx])
+
+def add_enrolled_speaker(username, embedding):
+    """Appends a freshly enrolled embedding to the in-memory cache so the
+    next login doesn't trigger a full rebuild."""
+    global _ENROLL_USERS, _ENROLL_MTX, _ENROLL_MTIME, _ENROLL_INDEX, _ENROLL_GPU
+    row = embedding.astype(np.float32)
+    row /= np.linalg.norm(row)
+    with _ENROLL_LOCK:
+        if _ENROLL_MTX is None:
+            return # Cache not built yet; next login builds it from disk
+        # Copy-on-write: build fresh objects instead of growing the old ones
+        # in place, so logins that already snapshotted (usernames, E, index)
+        # keep searching a consistent N-row view
+        _ENROLL_USERS = _ENROLL_USERS + [username]
+        _ENROLL_MTX = np.vstack([_ENROLL_MTX, row[None, :]])
+        _append_enrolled_mmap(username, row)
+        _ENROLL_INDEX = _rebuild_enroll_index(_ENROLL_MTX)
+        if model.device.type == 'cuda': _ENROLL_GPU = model.set_enrolled(_ENROLL_MTX) # Keep GPU copy in sync
+        try: _ENROLL_MTIME = os.path.getmtime(app.config['USER_DATA_FILE'])
+        except OSError: _ENROLL_MTIME = None
 
 # --- Routes (/, enroll GET, login GET, dashboard, logout - Keep as before) ---
 @app.route('/')
@@ -93,12 +337,12 @@ def index():
 @app.route('/enroll', methods=['GET'])
 def enroll():
      if 'logged_in' in session: return redirect(url_for('dashboard'))
-     return render_template('enroll.html', languages=SUPPORTED_LANGUAGES, prompts_json=json.dumps(LANGUAGE_PROMPTS))
+     return render_template('enroll.html', languages=SUPPORTED_LANGUAGES, prompts_json=LANGUAGE_PROMPTS_JSON)
 
 @app.route('/login', methods=['GET'])
 def login():
     if 'logged_in' in session: return redirect(url_for('dashboard'))
-    return render_template('login.html', languages=SUPPORTED_LANGUAGES, prompts_json=json.dumps(LANGUAGE_PROMPTS))
+    return render_template('login.html', languages=SUPPORTED_LANGUAGES, prompts_json=LANGUAGE_PROMPTS_JSON)
 
 @app.route('/dashboard')
 def dashboard():
@@ -124,22 +368,28 @@ def process_enrollment():
     if language not in SUPPORTED_LANGUAGES: return jsonify({"status":"error", "message":"Invalid language."}), 400
     user_data=load_user_data()
     if safe_username in user_data: return jsonify({"status":"error", "message":"Username exists."}), 400
-    embedding_filename=f"{safe_username}.npy"; embedding_path=os.path.join(app.config['EMBEDDING_DIR'], embedding_filename)
+    embedding_filename=f"{safe_username}.npz"; embedding_path=os.path.join(app.config['EMBEDDING_DIR'], embedding_filename)
     try:
-        audio_bytes=audio_file.read(); print(f"Enrollment audio: {len(audio_bytes)} bytes")
-        audio_waveform, sr=preprocess_audio_from_bytes(audio_bytes)
-        if audio_waveform is None: raise ValueError("Preprocessing failed.")
-        min_duration_sec=1.0
-        if len(audio_waveform) < SAMPLE_RATE * min_duration_sec: return jsonify({"status":"error", "message":"Audio too short."}), 400
-        print(f"Extracting embedding for {safe_username}...")
-        embedding=model.extract_embedding(audio_waveform, sr) # model
-        if embedding is None: raise ValueError("Embedding extraction failed.")
+        audio_bytes=audio_file.read(); logger.debug("Enrollment audio: %d bytes", len(audio_bytes))
+        cache_path=_audio_cache_path(audio_bytes)
+        embedding=_load_cached_embedding(cache_path)
+        if embedding is not None:
+            logger.debug("Embedding cache hit for enrollment audio (%s).", safe_username)
+        else:
+            audio_waveform, sr=preprocess_audio_from_bytes(audio_bytes)
+            if audio_waveform is None: raise ValueError("Preprocessing failed.")
+            min_duration_sec=1.0
+            if len(audio_waveform) < SAMPLE_RATE * min_duration_sec: return jsonify({"status":"error", "message":"Audio too short."}), 400
+            logger.debug("Extracting embedding for %s...", safe_username)
+            embedding=model.extract_embedding(audio_waveform, sr) # model
+            if embedding is None: raise ValueError("Embedding extraction failed.")
+            _store_cached_embedding(cache_path, embedding)
         model.save_embedding(embedding, embedding_path)
         user_data[safe_username]={"embedding_file": embedding_filename, "language": language}
-        save_user_data(user_data); print(f"User '{safe_username}' enrolled.")
+        save_user_data(user_data); add_enrolled_speaker(safe_username, embedding); logger.info("User '%s' enrolled.", safe_username)
         return jsonify({"status":"success", "message":f"User '{username}' enrolled."})
-    except ValueError as ve: print(f"Enroll ValueError: {ve}"); return jsonify({"status":"error", "message":f"Enrollment failed: {ve}"}), 500
-    except Exception as e: print(f"Enroll Exception: {e}"); traceback.print_exc(); return jsonify({"status":"error", "message":"Internal error."}), 500
+    except ValueError as ve: logger.error("Enroll ValueError: %s", ve); return jsonify({"status":"error", "message":f"Enrollment failed: {ve}"}), 500
+    except Exception: logger.exception("Enrollment failed with unexpected error"); return jsonify({"status":"error", "message":"Internal error."}), 500
 
 @app.route('/process_login', methods=['POST'])
 def process_login():
@@ -150,39 +400,41 @@ def process_login():
     audio_file = request.files['audio_data']
 
     # Load enrolled speakers
-    enrolled_embeddings = get_enrolled_speakers_embeddings()
-    if not enrolled_embeddings:
+    usernames, E, index, gpu = get_enrolled_speakers_embeddings()
+    if not usernames:
          return jsonify({"status": "error", "message": "No users enrolled yet. Please enroll first."}), 400
 
     try:
-        # Process Audio
+        # Process Audio (skipped entirely on an embedding-cache hit)
         audio_bytes = audio_file.read()
-        print(f"Received login audio: {len(audio_bytes)} bytes")
-        audio_waveform, sr = preprocess_audio_from_bytes(audio_bytes)
-        if audio_waveform is None: raise ValueError("Audio preprocessing failed.")
-        min_duration_sec = 1.0
-        if len(audio_waveform) < SAMPLE_RATE * min_duration_sec: return jsonify({"status": "error", "message": "Audio recording is too short."}), 400
+        logger.debug("Received login audio: %d bytes", len(audio_bytes))
+        cache_path = _audio_cache_path(audio_bytes)
+        login_embedding = _load_cached_embedding(cache_path)
+        if login_embedding is not None:
+            logger.debug("Embedding cache hit for login audio.")
+        else:
+            audio_waveform, sr = preprocess_audio_from_bytes(audio_bytes)
+            if audio_waveform is None: raise ValueError("Audio preprocessing failed.")
+            min_duration_sec = 1.0
+            if len(audio_waveform) < SAMPLE_RATE * min_duration_sec: return jsonify({"status": "error", "message": "Audio recording is too short."}), 400
 
-        # Extract Embedding
-        print("Extracting embedding for login attempt...")
-        login_embedding = model.extract_embedding(audio_waveform, sr)
-        if login_embedding is None: raise ValueError("Embedding extraction failed.")
+            # Extract Embedding
+            logger.debug("Extracting embedding for login attempt...")
+            login_embedding = model.extract_embedding(audio_waveform, sr)
+            if login_embedding is None: raise ValueError("Embedding extraction failed.")
+            _store_cached_embedding(cache_path, login_embedding)
 
         # --- Modified LOGIN LOGIC - Speaker Identification ---
-        min_distance = float('inf')
-        best_match_user = None
-        all_distances = {}
-
-        print(f"--- LOGIN: Comparing against enrolled users (Threshold = {app.config['COSINE_THRESHOLD']:.3f}) ---")
-        for username, enrolled_embedding in enrolled_embeddings.items():
-            try:
-                dist = cosine(login_embedding.astype(np.float32), enrolled_embedding.astype(np.float32))
-                all_distances[username] = dist # Store distance for logging
-                print(f"    Compared with '{username}': Distance = {dist:.4f}")
-                if dist < min_distance:
-                    min_distance = dist
-                    best_match_user = username
-            except Exception as calc_e: print(f"    Distance calculation error for {username}: {calc_e}")
+        # All cosine distances in one matrix-vector product (rows of E are
+        # pre-normalized, so cosine distance = 1 - dot product).
+        logger.debug("--- LOGIN: Comparing against enrolled users (Threshold = %.3f) ---", app.config['COSINE_THRESHOLD'])
+        q = login_embedding.astype(np.float32)
+        q /= np.linalg.norm(q)
+        idx, min_distance = _match_speaker(q, E, index, gpu)
+        best_match_user = usernames[idx]
+        if logger.isEnabledFor(logging.DEBUG):
+            for username, dist in zip(usernames, _cosine_distances(q, E, gpu).tolist()): # For logging only
+                logger.debug("    Compared with '%s': Distance = %.4f", username, dist)
 
         threshold = app.config['COSINE_THRESHOLD']
         # The speaker IS recognized
@@ -192,7 +444,7 @@ def process_login():
             user_data = load_user_data()
             session['language'] = user_data.get(best_match_user, {}).get('language', 'en')
 
-            print(f"✅ SUCCESS: Recognized user '{best_match_user}' (Distance = {min_distance:.4f} <= Threshold = {threshold:.3f})")
+            logger.info("SUCCESS: Recognized user '%s' (Distance = %.4f <= Threshold = %.3f)", best_match_user, min_distance, threshold)
             return jsonify({
                 "status": "success",
                 "message": f"Welcome, {best_match_user}!", # Note: change this welcome message!
@@ -201,13 +453,13 @@ def process_login():
             })
         # The speaker is NOT recognized
         else:
-            print(f"❌ FAILED: No match or all distances above threshold. Closest match was '{best_match_user}', Dist: {min_distance:.4f}, Threshold: {threshold:.3f}")
+            logger.info("FAILED: No match or all distances above threshold. Closest match was '%s', Dist: %.4f, Threshold: %.3f", best_match_user, min_distance, threshold)
             reason = f"Speaker not recognized. New user? Signup" # Directing to sign up for new user if it coudnt recognise from any of existing users
             return jsonify({"status": "error", "message": reason}), 401
     except ValueError as ve:
-        print(f"Login ValueError: {ve}"); return jsonify({"status": "error", "message": f"Login failed: {ve}"}), 500
+        logger.error("Login ValueError: %s", ve); return jsonify({"status": "error", "message": f"Login failed: {ve}"}), 500
     except Exception as e:
-        print(f"Login Exception: {e}"); traceback.print_exc(); return jsonify({"status": "error", "message": "Internal server error."}), 500
+        logger.exception("Login failed with unexpected error"); return jsonify({"status": "error", "message": "Internal server error."}), 500
 
 # --- Run Application ---
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 import librosa
 import soundfile as sf
@@ -6,6 +7,8 @@ import os
 from pydub import AudioSegment # Import pydub
 from pydub.exceptions import CouldntDecodeError # Import specific pydub error
 
+logger = logging.getLogger(__name__)
+
 # --- Check for FFmpeg (Optional but Recommended) ---
 # Simple check, might need refinement depending on system setup
 ffmpeg_found = False
@@ -14,86 +17,155 @@ try:
     import subprocess
     subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
     ffmpeg_found = True
-    print("INFO: FFmpeg found. Audio conversion enabled.")
+    logger.info("FFmpeg found. Audio conversion enabled.")
 except (FileNotFoundError, subprocess.CalledProcessError):
-    print("WARNING: FFmpeg not found or not executable.")
-    print("         pydub audio conversion might fail for non-WAV formats.")
-    print("         Please install FFmpeg and ensure it's in your system's PATH.")
+    logger.warning("FFmpeg not found or not executable. pydub audio conversion might fail "
+                   "for non-WAV formats. Please install FFmpeg and ensure it's in your system's PATH.")
     # Depending on your needs, you could make this a fatal error:
     # raise RuntimeError("FFmpeg is required but not found. Please install it.")
 
+# --- Optional soxr for fast polyphase resampling ---
+# C/SIMD polyphase resampler, 5-20x faster than librosa's kernel on the
+# per-request resample every login/enroll pays.
+try:
+    import soxr
+    logger.info("soxr found. Using polyphase resampler.")
+except ImportError:
+    soxr = None
+    logger.info("soxr not installed. Falling back to librosa.resample.")
+
+# --- Optional PyAV for in-process webm/opus decode ---
+# Decodes compressed uploads straight into NumPy without spawning an FFmpeg
+# subprocess or round-tripping through an intermediate WAV buffer.
+try:
+    import av
+    logger.info("PyAV found. Compressed audio decoded in-process.")
+except ImportError:
+    av = None
+    logger.info("PyAV not installed. Falling back to pydub/FFmpeg for compressed audio.")
+
 # Parameters
 SAMPLE_RATE = 16000  # ECAPA-TDNN expects 16kHz audio
 
+def _resample(audio, orig_sr):
+    """Resamples mono audio to SAMPLE_RATE (soxr when available, else librosa)."""
+    audio = np.ascontiguousarray(audio)
+    if soxr is not None:
+        return soxr.resample(audio, orig_sr, SAMPLE_RATE, quality='HQ')
+    return librosa.resample(y=audio, orig_sr=orig_sr, target_sr=SAMPLE_RATE)
+
 def load_audio(file_path):
     """Loads audio from a file path. Less robust for web uploads."""
     # ... (keep existing code, but maybe add a warning) ...
-    print(f"WARNING: Using load_audio for path {file_path}. Prefer _from_bytes for uploads.")
+    logger.warning("Using load_audio for path %s. Prefer _from_bytes for uploads.", file_path)
     try:
         audio, sr = sf.read(file_path, dtype='float32')
-        if audio.ndim > 1: audio = audio.mean(axis=1)
+        if audio.ndim > 1: audio = np.mean(audio, axis=1, dtype=np.float32) # Avoid float64 promotion
+
         if sr != SAMPLE_RATE:
-            audio = librosa.resample(y=np.ascontiguousarray(audio), orig_sr=sr, target_sr=SAMPLE_RATE)
+            audio = _resample(audio, sr)
         return audio, SAMPLE_RATE
     except Exception as e:
-        print(f"Error loading audio from path {file_path}: {e}")
+        logger.error("Error loading audio from path %s: %s", file_path, e)
         return None, None
 
+def _finalize_audio(audio, sr):
+    """Downmixes to mono and resamples to SAMPLE_RATE."""
+    if audio.ndim > 1:
+        logger.debug("Converting multi-channel audio to mono.")
+        # dtype=float32 keeps the reduction from promoting to float64 and
+        # re-casting afterwards - halves transient memory on stereo clips
+        audio = np.mean(audio, axis=1, dtype=np.float32)
+    if sr != SAMPLE_RATE:
+        logger.debug("Resampling from %sHz to %sHz", sr, SAMPLE_RATE)
+        audio = _resample(audio, sr)
+        logger.debug("Resampling complete. New sample count: %d", len(audio))
+    if audio.dtype != np.float32 or not audio.flags['C_CONTIGUOUS']:
+        audio = np.ascontiguousarray(audio, dtype=np.float32) # Only copies when needed
+    logger.debug("Processed audio: SR=%s, Samples=%d, Dtype=%s", SAMPLE_RATE, len(audio), audio.dtype)
+    return audio, SAMPLE_RATE
+
+def _decode_with_av(audio_bytes):
+    """Decodes compressed audio (webm/opus/ogg/...) with PyAV directly into
+    a float32 NumPy array. Returns (audio, sr)."""
+    container = av.open(io.BytesIO(audio_bytes))
+    try:
+        stream = container.streams.audio[0]
+        sr = stream.codec_context.sample_rate
+        frames = []
+        for frame in container.decode(stream):
+            arr = frame.to_ndarray()
+            if not frame.format.is_planar and arr.ndim == 2:
+                # Packed formats decode as (1, samples*channels) interleaved;
+                # deinterleave to (channels, samples) to match planar output
+                arr = arr.reshape(-1, len(frame.layout.channels)).T
+            frames.append(arr)
+        if not frames: raise ValueError("No audio frames decoded.")
+        audio = np.concatenate(frames, axis=-1)
+        if audio.dtype.kind == 'i': # Integer PCM -> float32 in [-1, 1]
+            audio = audio.astype(np.float32) / np.iinfo(audio.dtype).max
+        else:
+            audio = audio.astype(np.float32)
+        if audio.ndim > 1: audio = audio.T # (channels, samples) -> (samples, channels)
+        return audio, sr
+    finally:
+        container.close()
+
+def _sniff_format(audio_bytes):
+    """Identifies the container from its magic bytes so we can dispatch to
+    the cheapest decoder without paying a failed-decode attempt first."""
+    head = audio_bytes[:4]
+    if head == b'RIFF' or head == b'fLaC' or head == b'OggS' or head == b'FORM':
+        return 'sndfile' # WAV / FLAC / Ogg / AIFF - libsndfile handles these natively
+    if head == b'\x1aE\xdf\xa3':
+        return 'webm' # EBML header (webm/mkv) - browser MediaRecorder default
+    return 'unknown'
+
 def load_audio_from_bytes(audio_bytes):
     """
-    Load audio from bytes, CONVERT TO WAV using pydub, then read and resample.
+    Load audio from bytes: direct soundfile decode when possible (WAV/FLAC/
+    OGG uploads), PyAV for compressed formats, pydub+FFmpeg as last resort.
+    The container is sniffed from magic bytes to pick the decoder up front.
     """
+    fmt = _sniff_format(audio_bytes)
+
+    # 1. Direct decode: no subprocess, no intermediate WAV buffer.
+    # Skipped entirely for webm uploads, which libsndfile cannot read.
+    if fmt != 'webm':
+        try:
+            audio, sr = sf.read(io.BytesIO(audio_bytes), dtype='float32')
+            logger.debug("Soundfile decoded bytes directly: SR=%s, Samples=%d, Dims=%d", sr, len(audio), audio.ndim)
+            return _finalize_audio(audio, sr)
+        except (sf.LibsndfileError, RuntimeError):
+            logger.debug("Soundfile could not decode bytes directly; trying compressed-format decoders...")
+
+    # 2. PyAV: in-process decode of webm/opus/etc. straight into NumPy
+    if av is not None:
+        try:
+            audio, sr = _decode_with_av(audio_bytes)
+            logger.debug("PyAV decoded audio: SR=%s, Samples=%d, Dims=%d", sr, len(audio), audio.ndim)
+            return _finalize_audio(audio, sr)
+        except Exception as av_err:
+            logger.warning("PyAV could not decode audio stream (%s). Falling back to pydub/FFmpeg...", av_err)
+
+    # 3. Last resort: pydub -> FFmpeg subprocess -> WAV -> soundfile
     input_buffer = io.BytesIO(audio_bytes)
     output_buffer = io.BytesIO() # For storing the WAV data
-
     try:
-        # 1. Load audio using pydub (auto-detects format)
-        print("Attempting to load audio with pydub...")
+        logger.debug("Attempting to load audio with pydub...")
         audio_segment = AudioSegment.from_file(input_buffer) # pydub detects format
-        print(f"pydub loaded audio: Frame Rate={audio_segment.frame_rate}, Channels={audio_segment.channels}, Sample Width={audio_segment.sample_width}")
-
-        # 2. Export as WAV into the output buffer
-        print("Exporting audio segment as WAV...")
-        # Ensure export parameters match expectations if needed (e.g., forcing mono)
-        # audio_segment = audio_segment.set_channels(1) # Force mono *before* export if needed
+        logger.debug("pydub loaded audio: Frame Rate=%s, Channels=%s, Sample Width=%s", audio_segment.frame_rate, audio_segment.channels, audio_segment.sample_width)
         audio_segment.export(output_buffer, format="wav")
         output_buffer.seek(0) # Rewind buffer to the beginning for reading
-        print("Export to WAV format successful.")
-
-        # 3. Read the WAV data from the output buffer using soundfile
-        print("Reading WAV data from buffer using soundfile...")
         audio, sr = sf.read(output_buffer, dtype='float32')
-        print(f"Soundfile read WAV: Original SR={sr}, Samples={len(audio)}, Dtype={audio.dtype}, Dims={audio.ndim}")
-
-        # 4. Ensure mono
-        if audio.ndim > 1:
-            print("Converting multi-channel audio to mono.")
-            audio = audio.mean(axis=1)
-
-        # 5. Resample if necessary
-        if sr != SAMPLE_RATE:
-            print(f"Resampling from {sr}Hz to {SAMPLE_RATE}Hz")
-            audio_contiguous = np.ascontiguousarray(audio)
-            audio = librosa.resample(y=audio_contiguous, orig_sr=sr, target_sr=SAMPLE_RATE)
-            print(f"Resampling complete. New sample count: {len(audio)}")
-        else:
-             print(f"Audio already at target sample rate: {SAMPLE_RATE}Hz")
-
-        print(f"Processed audio: SR={SAMPLE_RATE}, Samples={len(audio)}, Dtype={audio.dtype}")
-        return audio, SAMPLE_RATE
-
+        logger.debug("Soundfile read WAV: Original SR=%s, Samples=%d, Dtype=%s, Dims=%d", sr, len(audio), audio.dtype, audio.ndim)
+        return _finalize_audio(audio, sr)
     except CouldntDecodeError as pydub_err:
-        print(f"Pydub Error: Could not decode audio stream. {pydub_err}")
-        print("             This might happen if FFmpeg is missing or the format is truly unsupported.")
-        return None, None
-    except sf.LibsndfileError as sf_err:
-        print(f"Soundfile Error reading converted WAV data: {sf_err}")
-        # This *shouldn't* happen now if pydub export worked, but good to keep.
+        logger.error("Pydub could not decode audio stream (%s). This might happen if FFmpeg "
+                     "is missing or the format is truly unsupported.", pydub_err)
         return None, None
     except Exception as e:
-        print(f"Generic Error during audio processing from bytes: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Generic Error during audio processing from bytes: %s", e)
         return None, None
     finally:
         # Close buffers (optional, handled by garbage collection, but explicit is okay)
@@ -105,7 +177,7 @@ def preprocess_audio_from_path(file_path):
     """
     Load and preprocess audio from a file path. USE WITH CAUTION.
     """
-    print(f"Preprocessing audio from path: {file_path}")
+    logger.debug("Preprocessing audio from path: %s", file_path)
     audio, sr = load_audio(file_path)
     return audio, sr
 
@@ -113,7 +185,7 @@ def preprocess_audio_from_bytes(audio_bytes):
     """
     Load, convert, and preprocess audio from bytes for ECAPA-TDNN.
     """
-    print("Preprocessing audio from bytes (with WAV conversion)...")
+    logger.debug("Preprocessing audio from bytes...")
     audio, sr = load_audio_from_bytes(audio_bytes)
     # Add any other preprocessing steps here if needed AFTER loading/resampling
     return audio, sr